@@ -8,6 +8,7 @@ import sys
 import time
 from pathlib import Path
 from dvelopdmspy.dvelopdmspy import DvelopDmsPy
+from sqlalchemy.orm import joinedload
 from wowicache.models import WowiCache, Building
 
 
@@ -49,33 +50,44 @@ def remove_leading_zeroes(input_str: str):
     return output_str
 
 
-def address_to_building(paddr: str, cache: WowiCache, config: configparser.ConfigParser):
+def get_building_index(cache: WowiCache) -> list:
+    buildings = cache.session.query(Building).options(joinedload(Building.economic_unit)).all()
+    ret_list = []
+    for entry in buildings:
+        if entry.id_num is None or entry.street_complete is None:
+            continue
+        ret_list.append({
+            "id_num": entry.id_num,
+            "company_id": entry.company_id,
+            "economic_unit": entry.economic_unit.id_num if entry.economic_unit is not None else None,
+            "street": entry.street_complete.replace(" ", "").strip().lower()
+        })
+    return ret_list
+
+
+def address_to_building(paddr: str, building_index: list, config: configparser.ConfigParser):
     paddr = paddr.replace(" ", "").strip().lower()
-    buildings = cache.session.query(Building).all()
     building_min = config.getint("cache_settings", "building_min", fallback=1)
     building_max = config.getint("cache_settings", "building_max", fallback=0)
     building_delimiter = config.get("cache_settings", "building_delimiter", fallback=None)
-    for entry in buildings:
-        if entry.id_num is None:
-            continue
+    for entry in building_index:
         if building_delimiter is not None and building_min > 1 and building_max > 0:
             try:
-                building_number = int(entry.id_num.split(building_delimiter)[-1])
+                building_number = int(entry["id_num"].split(building_delimiter)[-1])
             except ValueError:
                 continue
             if building_number < building_min or (building_number > 0 and building_number > building_max):
                 continue
-        if entry.street_complete is not None:
-            street = entry.street_complete.replace(" ", "").strip().lower()
-            if paddr in street:
-                return entry
-            elif paddr.replace("str.", "straße") in street:
-                return entry
+        street = entry["street"]
+        if paddr in street:
+            return entry
+        elif paddr.replace("str.", "straße") in street:
+            return entry
 
     return None
 
 
-def get_props_from_doc(pdoctext: str, pprops: list, cache: WowiCache, pconfig: configparser.ConfigParser,
+def get_props_from_doc(pdoctext: str, pprops: list, building_index: list, pconfig: configparser.ConfigParser,
                        dms: DvelopDmsPy):
     ret_props = []
     stored_vals = {}
@@ -123,26 +135,26 @@ def get_props_from_doc(pdoctext: str, pprops: list, cache: WowiCache, pconfig: c
             if item_lookup.lower() == "building_address":
                 prop_value = remove_leading_zeroes(prop_value)
                 prop_value = prop_value.replace("STRABE", "STRAßE")
-                prop_lookup_item: Building
                 logger.debug(f"address_to_building input: {prop_value}")
-                prop_lookup_item = address_to_building(prop_value, cache=cache, config=pconfig)
+                prop_lookup_item = address_to_building(prop_value, building_index=building_index, config=pconfig)
                 logger.debug(f"address_to_building output: {prop_lookup_item}")
                 if prop_lookup_item is not None:
                     # print(f"{prop_value} --> {prop_lookup_item.id_num}")
 
                     parent_guid_wie = pconfig.get("dvelop_fields", "wie")
                     parent_guid_vwg = pconfig.get("dvelop_fields", "vwg")
-                    if parent_guid_wie is not None and len(parent_guid_wie) > 30:
+                    if parent_guid_wie is not None and len(parent_guid_wie) > 30 \
+                            and prop_lookup_item["economic_unit"] is not None:
                         dms.add_upload_property(prop_guid=parent_guid_wie,
-                                                pvalue=prop_lookup_item.economic_unit.id_num,
+                                                pvalue=prop_lookup_item["economic_unit"],
                                                 plist=ret_props,
                                                 display_name="Wirtschaftseinheiten")
                     if parent_guid_vwg is not None and len(parent_guid_vwg) > 30:
                         dms.add_upload_property(prop_guid=parent_guid_vwg,
-                                                pvalue=prop_lookup_item.company_id,
+                                                pvalue=prop_lookup_item["company_id"],
                                                 plist=ret_props,
                                                 display_name="VWG")
-                    prop_value = prop_lookup_item.id_num
+                    prop_value = prop_lookup_item["id_num"]
                 else:
                     # print(f"{prop_value} --> ((NONE))")
                     prop_value = None
@@ -278,134 +290,181 @@ def write_part(temp_path: str, basename: str, pdf_stream, part_number, current_t
         }
 
 
-def split_and_get_text(source_file: str, page_map: dict, temp_path: str, basename: str):
+def is_blank_page(page_text: str) -> bool:
+    return len(page_text.strip()) < 20
+
+
+def get_page_texts(input_pdf_file: str) -> list:
+    with open(input_pdf_file, 'rb') as pdf_file:
+        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        return [page.extract_text() for page in pdf_reader.pages]
+
+
+def get_part_map(page_texts: list, page_map: dict) -> dict:
     ret_part_map = {}
-    current_doc = PyPDF2.PdfWriter()
+    current_pages = []
     current_text = None
+    current_map_id = None
+    current_blank_map_id = None
     last_part_num = 0
+    map_entry = None
     page_counter = 0
-    with open(source_file, 'rb') as pdf_file:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        for page_num in range(len(pdf_reader.pages)):
-            page_counter += 1
-            page = pdf_reader.pages[page_num]
-            page_text = page.extract_text()
-            map_entry = page_map.get(page_counter)
-            if map_entry is None:
-                continue
-            if last_part_num != map_entry.get("part_num"):
-                ret_part_map[last_part_num] = write_part(temp_path=temp_path,
-                                                         basename=basename,
-                                                         pdf_stream=current_doc,
-                                                         part_number=last_part_num,
-                                                         current_text=current_text,
-                                                         map_id=map_entry.get("map_id"))
-                current_doc = PyPDF2.PdfWriter()
-                current_text = None
-            current_doc.add_page(page)
-            if current_text is not None:
-                current_text = f"{current_text}\n{page_text}"
-            else:
-                current_text = page_text
-            last_part_num = map_entry.get("part_num")
-        if current_text is not None and map_entry is not None:
-            ret_part_map[last_part_num] = write_part(temp_path=temp_path,
-                                                     basename=basename,
-                                                     pdf_stream=current_doc,
-                                                     part_number=last_part_num,
-                                                     current_text=current_text,
-                                                     map_id=map_entry.get("map_id"))
-        return ret_part_map
+    for page_text in page_texts:
+        page_counter += 1
+        map_entry = page_map.get(page_counter)
+        if map_entry is None:
+            continue
+        if last_part_num != map_entry.get("part_num"):
+            ret_part_map[last_part_num] = {
+                "pages": current_pages,
+                "text": current_text,
+                "map_id": current_map_id if current_map_id is not None else current_blank_map_id
+            }
+            current_pages = []
+            current_text = None
+            current_map_id = None
+            current_blank_map_id = None
+        # Das Mapping eines Teils bestimmen seine Textseiten (alle mit derselben cr_id). Leere Seiten tragen bei
+        # blank_page_handling = add das Mapping der Vorseite und zählen nur, wenn der Teil sonst keine Seiten hat.
+        if is_blank_page(page_text):
+            if current_blank_map_id is None:
+                current_blank_map_id = map_entry.get("map_id")
+        else:
+            current_map_id = map_entry.get("map_id")
+        current_pages.append(page_counter)
+        if current_text is not None:
+            current_text = f"{current_text}\n{page_text}"
+        else:
+            current_text = page_text
+        last_part_num = map_entry.get("part_num")
+    if current_text is not None and map_entry is not None:
+        ret_part_map[last_part_num] = {
+            "pages": current_pages,
+            "text": current_text,
+            "map_id": current_map_id if current_map_id is not None else current_blank_map_id
+        }
+    return ret_part_map
 
 
-def process_pdf_file(input_pdf_file: str, mapping_dict: dict, temp_path: str, ignore_word_list: list,
-                     cache: WowiCache, dms: DvelopDmsPy, pconfig: configparser.ConfigParser,
-                     mapping_persistence: bool = False, mapping_persistence_sticky: bool = False):
-    logger.debug(f"Processing {input_pdf_file}")
-    basename = Path(input_pdf_file).stem
-    ret_dict = {}
-    with (open(input_pdf_file, 'rb') as pdf_file):
+def split_pdf_file(source_file: str, part_map: dict, temp_path: str, basename: str):
+    ret_file_map = {}
+    with open(source_file, 'rb') as pdf_file:
         pdf_reader = PyPDF2.PdfReader(pdf_file)
-        num_pages = len(pdf_reader.pages)
-        logger.debug(f"Number of pages: {num_pages}")
-
-        file_num = 0
-        last_cr_id = None
-        last_was_complete = True
-        page_counter = 0
-        page_map = {}
-        for page_num in range(num_pages):
-            page_counter += 1
-            page = pdf_reader.pages[page_num]
-            page_text = page.extract_text()
-            page_text_no_space = text_without_spaces(page_text)
-            if keywords_in_text(page_text_no_space, ignore_word_list, False):
+        for part_num in part_map.keys():
+            part = part_map.get(part_num)
+            current_doc = PyPDF2.PdfWriter()
+            for page_counter in part.get("pages"):
+                current_doc.add_page(pdf_reader.pages[page_counter - 1])
+            ret_file_map[part_num] = write_part(temp_path=temp_path,
+                                                basename=basename,
+                                                pdf_stream=current_doc,
+                                                part_number=part_num,
+                                                current_text=part.get("text"),
+                                                map_id=part.get("map_id"))
+    return ret_file_map
+
+
+def get_page_map(input_pdf_file: str, page_texts: list, mapping_dict: dict, ignore_word_list: list,
+                 pconfig: configparser.ConfigParser, mapping_persistence: bool = False,
+                 mapping_persistence_sticky: bool = False):
+    file_num = 0
+    last_cr_id = None
+    last_was_complete = True
+    page_counter = 0
+    page_map = {}
+    for page_text in page_texts:
+        page_counter += 1
+        page_text_no_space = text_without_spaces(page_text)
+        if keywords_in_text(page_text_no_space, ignore_word_list, False):
+            page_map[page_counter] = None
+            logger.warning(f"Page {page_counter} ignored because of blacklist.")
+            continue
+        if is_blank_page(page_text):
+            blank_handling = pconfig.get("general", "blank_page_handling", fallback="add").lower()
+            if blank_handling == "add":
+                page_map[page_counter] = {
+                    "map_id": last_cr_id,
+                    "complete": last_was_complete,
+                    "part_num": file_num
+                }
+            elif blank_handling == "ignore":
                 page_map[page_counter] = None
-                logger.warning(f"Page {page_counter} ignored because of blacklist.")
-                continue
-            if len(page_text.strip()) < 20:
-                blank_handling = pconfig.get("general", "blank_page_handling", fallback="add").lower()
-                if blank_handling == "add":
-                    page_map[page_counter] = {
-                        "map_id": last_cr_id,
-                        "complete": last_was_complete,
-                        "part_num": file_num
-                    }
-                elif blank_handling == "ignore":
-                    page_map[page_counter] = None
-                elif blank_handling == "fail":
-                    logger.error(f"No text on page {page_counter} of file {input_pdf_file}. Exiting.")
-                    return None
-                continue
+            elif blank_handling == "fail":
+                logger.error(f"No text on page {page_counter} of file {input_pdf_file}. Exiting.")
+                return None
+            continue
 
-            logger.debug(f"Extracted text from page {page_counter}:\n{page_text}")
+        logger.debug(f"Extracted text from page {page_counter}:\n{page_text}")
 
-            cr_id = get_mapping_id(page_text_no_space, mapping_dict)
-            needs_separation = False
-            if last_cr_id and cr_id != last_cr_id and not last_was_complete:
-                if mapping_persistence_sticky:
-                    cr_id = last_cr_id
-                else:
-                    needs_separation = True
-            if cr_id is None and not last_was_complete and mapping_persistence:
+        cr_id = get_mapping_id(page_text_no_space, mapping_dict)
+        needs_separation = False
+        if last_cr_id and cr_id != last_cr_id and not last_was_complete:
+            if mapping_persistence_sticky:
                 cr_id = last_cr_id
+            else:
+                needs_separation = True
+        if cr_id is None and not last_was_complete and mapping_persistence:
+            cr_id = last_cr_id
 
-            if cr_id is not None:
-                cr_comp = keywords_in_text(page_text_no_space, mapping_dict.get(cr_id).get("completion"))
+        if cr_id is not None:
+            cr_comp = keywords_in_text(page_text_no_space, mapping_dict.get(cr_id).get("completion"))
 
-            if cr_id is None and "fallback" in mapping_dict.keys():
-                needs_separation = True
-                cr_id = "fallback"
-                cr_comp = True
+        if cr_id is None and "fallback" in mapping_dict.keys():
+            needs_separation = True
+            cr_id = "fallback"
+            cr_comp = True
 
-            if cr_id is None:
-                logger.error(f"Could not determin mapping for file {input_pdf_file} page {page_counter}")
-                logger.error(page_text)
-                return None
+        if cr_id is None:
+            logger.error(f"Could not determin mapping for file {input_pdf_file} page {page_counter}")
+            logger.error(page_text)
+            return None
 
-            if needs_separation and not last_was_complete:
-                file_num += 1
+        if needs_separation and not last_was_complete:
+            file_num += 1
 
-            pagemap_entry = {
-                "map_id": cr_id,
-                "complete": cr_comp,
-                "part_num": file_num
-            }
-            if cr_comp:
-                file_num += 1
-            last_cr_id = cr_id
-            last_was_complete = cr_comp
-            page_map[page_counter] = pagemap_entry
+        pagemap_entry = {
+            "map_id": cr_id,
+            "complete": cr_comp,
+            "part_num": file_num
+        }
+        if cr_comp:
+            file_num += 1
+        last_cr_id = cr_id
+        last_was_complete = cr_comp
+        page_map[page_counter] = pagemap_entry
 
     logger.debug(f"page_map:{page_map}")
-    file_map = split_and_get_text(source_file=input_pdf_file, page_map=page_map, temp_path=temp_path, basename=basename)
+    return page_map
+
+
+def process_pdf_file(input_pdf_file: str, mapping_dict: dict, temp_path: str, ignore_word_list: list,
+                     building_index: list, dms: DvelopDmsPy, pconfig: configparser.ConfigParser,
+                     mapping_persistence: bool = False, mapping_persistence_sticky: bool = False):
+    logger.debug(f"Processing {input_pdf_file}")
+    basename = Path(input_pdf_file).stem
+    ret_dict = {}
+    page_texts = get_page_texts(input_pdf_file)
+    logger.debug(f"Number of pages: {len(page_texts)}")
+
+    page_map = get_page_map(input_pdf_file=input_pdf_file,
+                            page_texts=page_texts,
+                            mapping_dict=mapping_dict,
+                            ignore_word_list=ignore_word_list,
+                            pconfig=pconfig,
+                            mapping_persistence=mapping_persistence,
+                            mapping_persistence_sticky=mapping_persistence_sticky)
+    if page_map is None:
+        return None
+
+    part_map = get_part_map(page_texts=page_texts, page_map=page_map)
+    file_map = split_pdf_file(source_file=input_pdf_file, part_map=part_map, temp_path=temp_path, basename=basename)
     # logger.debug(f"file_map:{file_map}")
     for entry_id in file_map.keys():
         entry = file_map.get(entry_id)
         map_id = entry.get("map_id")
         dest_props = get_props_from_doc(pdoctext=entry.get("text"),
                                         pprops=mapping_dict.get(map_id).get("prop"),
-                                        cache=cache,
+                                        building_index=building_index,
                                         pconfig=pconfig,
                                         dms=dms)
         dest_cat_guid = mapping_dict.get(map_id).get("category_id")
@@ -480,9 +539,12 @@ def process_profile(profile_filepath: str, dms: DvelopDmsPy, cache: WowiCache):
 
     logger.debug(f"ignore_keywords: {ignore_keywords}")
 
-    pathlist = Path(input_path).rglob('*.pdf')
+    pathlist = list(Path(input_path).rglob('*.pdf'))
     file_counter = 0
 
+    # Gebäude einmal pro Profil laden statt bei jeder Adresssuche die komplette Tabelle abzufragen
+    building_index = get_building_index(cache) if len(pathlist) > 0 else []
+
     for sfile in pathlist:
         file_counter += 1
         # Split files and math creditors
@@ -491,7 +553,7 @@ def process_profile(profile_filepath: str, dms: DvelopDmsPy, cache: WowiCache):
                                           mapping_dict=proflist,
                                           temp_path=os.path.join(current_dir, "temp"),
                                           ignore_word_list=ignore_keywords,
-                                          cache=cache,
+                                          building_index=building_index,
                                           dms=dms,
                                           mapping_persistence=mapping_persist,
                                           mapping_persistence_sticky=mapping_persist_sticky,
@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import configparser
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import log
+from processing import get_page_texts, get_mapping_props, get_mappings, get_page_map, get_part_map, \
+    get_props_from_doc, get_building_index
+from wowicache.models import WowiCache
+
+
+def handle_unhandled_exception(exc_type, exc_value, exc_traceback):
+    if issubclass(exc_type, KeyboardInterrupt):
+        sys.__excepthook__(exc_type, exc_value, exc_traceback)
+        return
+    logger.critical("Unhandled exception", exc_info=(exc_type, exc_value, exc_traceback))
+
+
+class LocalPropertyList:
+    # Ersatz für DvelopDmsPy.add_upload_property ohne Verbindung zum DMS. Eigenschaften ohne GUID werden unter
+    # ihrem Anzeigenamen statt unter dem im DMS aufgelösten Key geführt.
+    @staticmethod
+    def add_upload_property(display_name: str, pvalue, prop_guid: str = None, plist: list = None) -> list:
+        if plist is None:
+            plist = []
+        if type(pvalue) is not list:
+            pvalue = [pvalue]
+        plist.append({
+            'key': prop_guid if prop_guid is not None else display_name,
+            'values': pvalue
+        })
+        return plist
+
+
+def get_cached_page_texts(pdf_path: str, cache_path: str):
+    # Der Cache ist über den Dateiinhalt adressiert, damit umbenannte Backups nicht erneut ausgelesen werden
+    try:
+        with open(pdf_path, 'rb') as pdf_file:
+            digest = hashlib.sha1(pdf_file.read()).hexdigest()
+    except (OSError, IOError) as e:
+        logger.error(f"Error while reading {pdf_path}: {str(e)}")
+        return pdf_path, None
+
+    cache_file_path = os.path.join(cache_path, f"{digest}.json")
+    if os.path.exists(cache_file_path):
+        try:
+            with open(cache_file_path, 'r', encoding='utf-8') as cache_file:
+                return pdf_path, json.load(cache_file)
+        except (OSError, IOError, ValueError) as e:
+            logger.warning(f"Ignoring broken page cache {cache_file_path}: {str(e)}")
+
+    # PyPDF2 wirft bei beschädigten Dateien nicht nur PdfReadError (z.B. struct.error, KeyError, ValueError)
+    try:
+        page_texts = get_page_texts(pdf_path)
+    except Exception as e:
+        logger.error(f"Error while extracting text from {pdf_path}: {str(e)}")
+        return pdf_path, None
+
+    try:
+        temp_file_path = f"{cache_file_path}.{os.getpid()}.tmp"
+        with open(temp_file_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(page_texts, cache_file)
+        os.replace(temp_file_path, cache_file_path)
+    except (OSError, IOError) as e:
+        logger.warning(f"Could not write page cache {cache_file_path}: {str(e)}")
+    return pdf_path, page_texts
+
+
+def load_profile(profile_filepath: str):
+    profile_basename = os.path.splitext(os.path.basename(profile_filepath))[0]
+    profile_folder = os.path.dirname(profile_filepath).rstrip(os.path.sep)
+    profile_maps = os.path.join(profile_folder, f"{profile_basename}.map")
+    profile_props = os.path.join(profile_folder, f"{profile_basename}.prop")
+    for file_path in [profile_filepath, profile_maps, profile_props]:
+        if not os.path.exists(file_path):
+            logger.error(f"File {file_path} does not exist")
+            return None
+
+    pconfig = configparser.ConfigParser(delimiters=('=',))
+    pconfig.read(profile_filepath, encoding='utf-8')
+    ignore_keywords_str = pconfig.get("general", "ignore_keywords", fallback=None)
+    ignore_keywords = []
+    if ignore_keywords_str is not None and len(ignore_keywords_str) > 0:
+        ignore_keywords = ignore_keywords_str.split("|")
+
+    return {
+        "name": profile_filepath,
+        "config": pconfig,
+        "mappings": get_mappings(profile_maps, get_mapping_props(profile_prop_path=profile_props)),
+        "ignore_keywords": ignore_keywords,
+        "mapping_persistence": pconfig.getboolean("general", "mapping_persistence", fallback=False),
+        "mapping_persistence_sticky": pconfig.getboolean("general", "mapping_persistence_sticky", fallback=False)
+    }
+
+
+def simulate_pdf_file(pdf_path: str, page_texts: list, profile: dict, building_index: list, dms):
+    page_map = get_page_map(input_pdf_file=pdf_path,
+                            page_texts=page_texts,
+                            mapping_dict=profile["mappings"],
+                            ignore_word_list=profile["ignore_keywords"],
+                            pconfig=profile["config"],
+                            mapping_persistence=profile["mapping_persistence"],
+                            mapping_persistence_sticky=profile["mapping_persistence_sticky"])
+    if page_map is None:
+        return None
+
+    ret_list = []
+    part_map = get_part_map(page_texts=page_texts, page_map=page_map)
+    for part_num in part_map.keys():
+        part = part_map.get(part_num)
+        mapping = profile["mappings"].get(part.get("map_id"))
+        if mapping is None:
+            logger.error(f"Part {part_num} of file {pdf_path} has no mapping")
+            return None
+        ret_list.append({
+            "part": part_num,
+            "pages": part.get("pages"),
+            "map_id": part.get("map_id"),
+            "cat_id": mapping.get("category_id"),
+            "cat_name": mapping.get("category_name"),
+            "props": get_props_from_doc(pdoctext=part.get("text"),
+                                        pprops=mapping.get("prop"),
+                                        building_index=building_index,
+                                        pconfig=profile["config"],
+                                        dms=dms)
+        })
+    if len(ret_list) == 0:
+        return None
+    return ret_list
+
+
+def try_simulate_pdf_file(pdf_path: str, page_texts: list, profile: dict, building_index: list, dms):
+    # Fehler im Profil (z.B. ungültige Regex, fehlende Sektion) sollen nur diese Datei betreffen
+    try:
+        return simulate_pdf_file(pdf_path, page_texts, profile, building_index, dms), None
+    except Exception as e:
+        logger.error(f"Error while simulating {pdf_path} with profile {profile['name']}: {repr(e)}")
+        return None, repr(e)
+
+
+def init_simulation_worker(cache_path: str, old_profile: dict, new_profile: dict, building_index: list):
+    # Profile und Gebäudeindex werden einmal pro Prozess übergeben statt mit jeder Datei
+    worker_state["cache_path"] = cache_path
+    worker_state["old_profile"] = old_profile
+    worker_state["new_profile"] = new_profile
+    worker_state["building_index"] = building_index
+    worker_state["dms"] = LocalPropertyList()
+
+
+def simulate_file(pdf_path: str):
+    pdf_path, page_texts = get_cached_page_texts(pdf_path, worker_state["cache_path"])
+    if page_texts is None:
+        return pdf_path, None
+    old_parts, old_error = try_simulate_pdf_file(pdf_path, page_texts, worker_state["old_profile"],
+                                                 worker_state["building_index"], worker_state["dms"])
+    new_parts, new_error = try_simulate_pdf_file(pdf_path, page_texts, worker_state["new_profile"],
+                                                 worker_state["building_index"], worker_state["dms"])
+    return pdf_path, {
+        "old": old_parts,
+        "new": new_parts,
+        "old_error": old_error,
+        "new_error": new_error
+    }
+
+
+def get_changes(old_parts: list, new_parts: list) -> list:
+    if old_parts is None or new_parts is None:
+        return ["result"] if old_parts != new_parts else []
+    changes = []
+    if [x["map_id"] for x in old_parts] != [x["map_id"] for x in new_parts]:
+        changes.append("mapping")
+    if [x["pages"] for x in old_parts] != [x["pages"] for x in new_parts]:
+        changes.append("parts")
+    if [(x["cat_id"], x["cat_name"], x["props"]) for x in old_parts] != \
+            [(x["cat_id"], x["cat_name"], x["props"]) for x in new_parts]:
+        changes.append("props")
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs two versions of a profile over archived PDF files without "
+                                                 "writing or uploading anything and reports the differences in "
+                                                 "mappings, part boundaries and property values. "
+                                                 "No DMS connection is needed; the building index is loaded "
+                                                 "from [openwowi] cache_connection in config.ini.")
+    parser.add_argument("old_profile", help="Path to the .ini file of the current profile version")
+    parser.add_argument("new_profile", help="Path to the .ini file of the changed profile version")
+    parser.add_argument("input_path", help="Folder with archived PDF files (searched recursively)")
+    # Relative Pfade aus der config.ini beziehen sich wie die Fallbacks auf den App-Ordner
+    parser.add_argument("--report", default=os.path.join(current_dir,
+                                                         config.get("simulation", "report_path",
+                                                                    fallback=os.path.join("logs",
+                                                                                          "simulation_report.json"))),
+                        help="Path of the JSON report")
+    parser.add_argument("--cache", default=os.path.join(current_dir,
+                                                        config.get("simulation", "cache_path",
+                                                                   fallback=os.path.join("temp", "pagecache"))),
+                        help="Folder for cached page texts")
+    parser.add_argument("--workers", type=int, default=config.getint("simulation", "workers", fallback=0),
+                        help="Number of worker processes (0 = number of CPUs)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input_path):
+        logger.error(f"Path {args.input_path} does not exist.")
+        sys.exit(1)
+    os.makedirs(args.cache, exist_ok=True)
+
+    old_profile = load_profile(args.old_profile)
+    new_profile = load_profile(args.new_profile)
+    if old_profile is None or new_profile is None:
+        sys.exit(1)
+
+    pathlist = sorted(str(x) for x in Path(args.input_path).rglob('*.pdf'))
+    logger.info(f"Simulating {args.old_profile} against {args.new_profile} on {len(pathlist)} files")
+    if len(pathlist) == 0:
+        sys.exit(0)
+
+    cache = WowiCache(config.get("openwowi", "cache_connection"))
+    building_index = get_building_index(cache)
+
+    differences = []
+    failed_files = []
+    error_count = 0
+    with ProcessPoolExecutor(max_workers=args.workers or None, initializer=init_simulation_worker,
+                             initargs=(args.cache, old_profile, new_profile, building_index)) as executor:
+        for pdf_path, result in executor.map(simulate_file, pathlist, chunksize=16):
+            if result is None:
+                failed_files.append(pdf_path)
+                continue
+            if result["old_error"] is not None or result["new_error"] is not None:
+                error_count += 1
+                differences.append({"file": os.path.relpath(pdf_path, args.input_path),
+                                    "changes": ["error"],
+                                    **result})
+                continue
+            changes = get_changes(result["old"], result["new"])
+            if len(changes) == 0:
+                continue
+            logger.info(f"{pdf_path}: {', '.join(changes)} changed")
+            differences.append({"file": os.path.relpath(pdf_path, args.input_path),
+                                "changes": changes,
+                                "old": result["old"],
+                                "new": result["new"]})
+
+    report = {
+        "old_profile": args.old_profile,
+        "new_profile": args.new_profile,
+        "input_path": args.input_path,
+        "file_count": len(pathlist),
+        "changed_count": len(differences) - error_count,
+        "error_count": error_count,
+        "failed_files": failed_files,
+        "differences": differences
+    }
+    with open(args.report, 'w', encoding='utf-8') as report_file:
+        json.dump(report, report_file, ensure_ascii=False, indent=2)
+
+    summary = f"Simulation finished: {len(differences) - error_count} of {len(pathlist)} files changed, " \
+              f"{error_count} with profile errors, {len(failed_files)} unreadable. Report written to {args.report}"
+    logger.info(summary)
+
+
+sys.excepthook = handle_unhandled_exception
+worker_state = {}
+current_dir = os.path.abspath(os.path.dirname(__file__))
+config = configparser.ConfigParser(delimiters=('=',))
+config.read(os.path.join(current_dir, "config.ini"), encoding='utf-8')
+
+logger = log.setup_custom_logger('root', config.get('Logging', 'method', fallback='file'),
+                                 config.get('Logging', 'level', fallback='info'),
+                                 graylog_host=config.get('Logging', 'graylog_host', fallback=None),
+                                 graylog_port=config.getint('Logging', 'graylog_port', fallback=0),
+                                 graylog_app_name=config.get('Logging', 'graylog_app_name', fallback=None))
+
+if __name__ == "__main__":
+    main()